@@ -0,0 +1,40 @@
+CREATE TABLE IF NOT EXISTS search.data_version (
+  id int PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  version bigint NOT NULL DEFAULT 1,
+  updated_at timestamptz DEFAULT now()
+);
+
+INSERT INTO search.data_version (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION search.bump_data_version()
+RETURNS bigint LANGUAGE sql AS $$
+  UPDATE search.data_version
+  SET version = version + 1, updated_at = now()
+  WHERE id = 1
+  RETURNING version
+$$;
+
+CREATE TABLE IF NOT EXISTS search.result_cache (
+  cache_key text PRIMARY KEY,
+  data_version bigint NOT NULL,
+  query_norm text NOT NULL,
+  scenario text NOT NULL,
+  geo_key text NOT NULL,
+  results jsonb NOT NULL,
+  compute_ms double precision NOT NULL,
+  hits bigint NOT NULL DEFAULT 0,
+  created_at timestamptz DEFAULT now(),
+  last_hit_at timestamptz DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_result_cache_last_hit ON search.result_cache (last_hit_at);
+
+CREATE TABLE IF NOT EXISTS search.result_cache_stats (
+  id int PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  hits bigint NOT NULL DEFAULT 0,
+  misses bigint NOT NULL DEFAULT 0,
+  saved_ms double precision NOT NULL DEFAULT 0,
+  evictions bigint NOT NULL DEFAULT 0
+);
+
+INSERT INTO search.result_cache_stats (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,21 @@
+CREATE TABLE IF NOT EXISTS search.embedding_queue (
+  place_id bigint NOT NULL REFERENCES search.places(place_id) ON DELETE CASCADE,
+  model text NOT NULL,
+  status text NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'claimed', 'done', 'failed')),
+  worker_id text,
+  attempts int NOT NULL DEFAULT 0,
+  enqueued_at timestamptz DEFAULT now(),
+  claimed_at timestamptz,
+  lease_until timestamptz,
+  done_at timestamptz,
+  last_error text,
+  PRIMARY KEY (place_id, model)
+);
+
+CREATE INDEX IF NOT EXISTS idx_embedding_queue_claimable
+  ON search.embedding_queue (model, place_id)
+  WHERE status IN ('pending', 'claimed');
+
+CREATE INDEX IF NOT EXISTS idx_embedding_queue_done_worker
+  ON search.embedding_queue (model, worker_id, done_at)
+  WHERE status = 'done';
@@ -0,0 +1,6 @@
+-- Also defined in infra/osm2pgsql/flex/raw.lua. osm2pgsql --append does not
+-- create tables, so databases imported before the table existed get it here.
+CREATE TABLE IF NOT EXISTS raw.osm_changes (
+  osm_type text NOT NULL,
+  osm_id bigint NOT NULL
+);
@@ -31,7 +31,26 @@ local raw_polygons = osm2pgsql.define_table({
   },
 })
 
+-- Objects (re)processed during `--append`, including ways/relations that
+-- osm2pgsql revisits because a member changed. transform.py --osc consumes
+-- and truncates this table. Deletions come from the .osc file itself.
+local raw_changes = osm2pgsql.define_table({
+  name = 'osm_changes',
+  schema = 'raw',
+  columns = {
+    { column = 'osm_type', type = 'text', not_null = true },
+    { column = 'osm_id', type = 'bigint', not_null = true },
+  },
+})
+
+local function record_change(osm_type, object)
+  if osm2pgsql.mode == 'append' then
+    raw_changes:insert({ osm_type = osm_type, osm_id = object.id })
+  end
+end
+
 function osm2pgsql.process_node(object)
+  record_change('node', object)
   if not object.tags or next(object.tags) == nil then
     return
   end
@@ -44,6 +63,7 @@ function osm2pgsql.process_node(object)
 end
 
 function osm2pgsql.process_way(object)
+  record_change('way', object)
   if not object.tags or next(object.tags) == nil then
     return
   end
@@ -66,6 +86,7 @@ function osm2pgsql.process_way(object)
 end
 
 function osm2pgsql.process_relation(object)
+  record_change('relation', object)
   if not object.tags or next(object.tags) == nil then
     return
   end
@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 import argparse
 import os
-from typing import Iterable, List, Tuple
+import socket
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
 import psycopg
 import requests
 import yaml
 
+import result_cache
+from embedding_client import EmbeddingClient
+
 
 def load_embedding_config(path: str) -> Tuple[str, int]:
     with open(path, "r", encoding="utf-8") as f:
@@ -14,10 +18,18 @@ def load_embedding_config(path: str) -> Tuple[str, int]:
     return cfg["model"], int(cfg["dims"])
 
 
-def fetch_places(conn: psycopg.Connection, model: str, limit: int, force: bool) -> Iterable[Tuple[int, str]]:
+def fetch_places(conn: psycopg.Connection, model: str, limit: int, force: bool,
+                 after_id: int) -> Iterable[Tuple[int, str]]:
+    # Keyset on place_id so texts that failed to embed are not fetched again.
     if force:
-        sql = "SELECT place_id, text_for_search FROM search.places ORDER BY place_id LIMIT %s"
-        params = (limit,)
+        sql = """
+        SELECT place_id, text_for_search
+        FROM search.places
+        WHERE place_id > %s
+        ORDER BY place_id
+        LIMIT %s
+        """
+        params: Tuple[object, ...] = (after_id, limit)
     else:
         sql = """
         SELECT p.place_id, p.text_for_search
@@ -25,28 +37,294 @@ def fetch_places(conn: psycopg.Connection, model: str, limit: int, force: bool)
         LEFT JOIN search.place_embeddings e
           ON p.place_id = e.place_id AND e.model = %s
         WHERE e.place_id IS NULL
+          AND p.place_id > %s
         ORDER BY p.place_id
         LIMIT %s
         """
-        params = (model, limit)
+        params = (model, after_id, limit)
 
     with conn.cursor() as cur:
         cur.execute(sql, params)
         return cur.fetchall()
 
 
-def ollama_embed(ollama_url: str, model: str, texts: List[str]) -> List[List[float]]:
-    r = requests.post(
-        f"{ollama_url.rstrip('/')}/api/embed",
-        json={"model": model, "input": texts},
-        timeout=120,
+def to_pgvector_literal(vec: List[float]) -> str:
+    return "[" + ",".join(f"{x:.8f}" for x in vec) + "]"
+
+
+def write_embeddings(conn: psycopg.Connection, model: str, place_ids: Sequence[int],
+                     embeddings: Sequence[List[float]]) -> None:
+    with conn.cursor() as cur:
+        for place_id, vec in zip(place_ids, embeddings):
+            cur.execute(
+                """
+                INSERT INTO search.place_embeddings (place_id, model, embedding)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (place_id, model) DO UPDATE
+                SET embedding = EXCLUDED.embedding, created_at = now()
+                """,
+                (place_id, model, to_pgvector_literal(vec)),
+            )
+
+
+def enqueue_places(conn: psycopg.Connection, model: str, force: bool) -> int:
+    if force:
+        sql = """
+        INSERT INTO search.embedding_queue (place_id, model)
+        SELECT p.place_id, %s FROM search.places p
+        ON CONFLICT (place_id, model) DO UPDATE
+        SET status = 'pending', worker_id = NULL, lease_until = NULL, attempts = 0, last_error = NULL,
+            enqueued_at = now()
+        """
+        params: Tuple[object, ...] = (model,)
+    else:
+        sql = """
+        INSERT INTO search.embedding_queue (place_id, model)
+        SELECT p.place_id, %s
+        FROM search.places p
+        LEFT JOIN search.place_embeddings e
+          ON p.place_id = e.place_id AND e.model = %s
+        WHERE e.place_id IS NULL
+        ON CONFLICT (place_id, model) DO UPDATE
+        SET status = 'pending', worker_id = NULL, lease_until = NULL, attempts = 0, last_error = NULL,
+            enqueued_at = now()
+        WHERE search.embedding_queue.status = 'failed'
+        """
+        params = (model, model)
+
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        count = cur.rowcount
+    conn.commit()
+    return count
+
+
+def claim_batch(conn: psycopg.Connection, model: str, worker_id: str, batch_size: int,
+                lease_seconds: int, max_attempts: int) -> List[Tuple[int, str]]:
+    # A row whose lease keeps expiring is most likely crashing its workers;
+    # park it as failed instead of handing it to the next one.
+    fail_sql = """
+    UPDATE search.embedding_queue
+    SET status = 'failed', lease_until = NULL,
+        last_error = COALESCE(last_error, 'lease expired after ' || attempts || ' attempts')
+    WHERE model = %s
+      AND status = 'claimed'
+      AND lease_until < now()
+      AND attempts >= %s
+    """
+    # Pending rows and rows whose lease has expired (crashed worker) are both claimable.
+    sql = """
+    WITH claimable AS (
+      SELECT q.place_id
+      FROM search.embedding_queue q
+      WHERE q.model = %(model)s
+        AND (q.status = 'pending' OR (q.status = 'claimed' AND q.lease_until < now()))
+        AND q.attempts < %(max_attempts)s
+      ORDER BY q.place_id
+      LIMIT %(batch_size)s
+      FOR UPDATE SKIP LOCKED
     )
-    r.raise_for_status()
-    return r.json()["embeddings"]
+    UPDATE search.embedding_queue q
+    SET status = 'claimed',
+        worker_id = %(worker_id)s,
+        attempts = q.attempts + 1,
+        claimed_at = now(),
+        lease_until = now() + make_interval(secs => %(lease_seconds)s)
+    FROM claimable c
+    JOIN search.places p ON p.place_id = c.place_id
+    WHERE q.place_id = c.place_id
+      AND q.model = %(model)s
+    RETURNING q.place_id, p.text_for_search
+    """
+    params = {
+        "model": model,
+        "worker_id": worker_id,
+        "batch_size": batch_size,
+        "lease_seconds": lease_seconds,
+        "max_attempts": max_attempts,
+    }
+    with conn.cursor() as cur:
+        cur.execute(fail_sql, (model, max_attempts))
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    conn.commit()
+    return sorted(rows)
 
 
-def to_pgvector_literal(vec: List[float]) -> str:
-    return "[" + ",".join(f"{x:.8f}" for x in vec) + "]"
+def complete_batch(conn: psycopg.Connection, model: str, worker_id: str, place_ids: Sequence[int],
+                   embeddings: Sequence[List[float]]) -> int:
+    # Only rows this worker still holds are completed. A row whose lease expired
+    # and was reclaimed, or that was requeued (--force, text change), is left to
+    # its new owner so a vector for stale text never overwrites the fresh one.
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE search.embedding_queue
+            SET status = 'done', done_at = now(), lease_until = NULL
+            WHERE model = %s
+              AND place_id = ANY(%s)
+              AND status = 'claimed'
+              AND worker_id = %s
+            RETURNING place_id
+            """,
+            (model, list(place_ids), worker_id),
+        )
+        owned = {row[0] for row in cur.fetchall()}
+    kept = [(pid, vec) for pid, vec in zip(place_ids, embeddings) if pid in owned]
+    if kept:
+        write_embeddings(conn, model, [pid for pid, _ in kept], [vec for _, vec in kept])
+    conn.commit()
+    return len(kept)
+
+
+def fail_rows(conn: psycopg.Connection, model: str, worker_id: str, errors: Dict[int, str]) -> None:
+    with conn.cursor() as cur:
+        for place_id, error in errors.items():
+            cur.execute(
+                """
+                UPDATE search.embedding_queue
+                SET status = 'failed', lease_until = NULL, last_error = %s
+                WHERE model = %s AND place_id = %s AND status = 'claimed' AND worker_id = %s
+                """,
+                (error, model, place_id, worker_id),
+            )
+    conn.commit()
+
+
+def renew_lease(conn: psycopg.Connection, model: str, worker_id: str, place_ids: Sequence[int],
+                lease_seconds: int) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE search.embedding_queue
+            SET lease_until = now() + make_interval(secs => %s)
+            WHERE model = %s AND place_id = ANY(%s) AND status = 'claimed' AND worker_id = %s
+            """,
+            (lease_seconds, model, list(place_ids), worker_id),
+        )
+    conn.commit()
+
+
+def embed_rows(client: EmbeddingClient, rows: Sequence[Tuple[int, str]], dims: int,
+               on_request: Optional[Callable[[], None]] = None) -> Tuple[List[Tuple[int, List[float]]], Dict[int, str]]:
+    place_ids, texts = zip(*rows)
+    vectors, failures = client.embed(list(texts), on_request=on_request)
+    embedded = [(place_ids[i], vec) for i, vec in enumerate(vectors) if vec is not None]
+    if any(len(vec) != dims for _, vec in embedded):
+        raise SystemExit("Embedding dimension mismatch")
+    errors = {place_ids[i]: error for i, error in failures.items()}
+    for place_id, error in errors.items():
+        print(f"skipped place_id={place_id}: {error}")
+    return embedded, errors
+
+
+def release_claims(conn: psycopg.Connection, model: str, worker_id: str, place_ids: Sequence[int]) -> None:
+    # The endpoint failed, not the place: hand the rows back without spending an attempt.
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE search.embedding_queue
+            SET status = 'pending', worker_id = NULL, lease_until = NULL, attempts = GREATEST(attempts - 1, 0)
+            WHERE model = %s AND place_id = ANY(%s) AND status = 'claimed' AND worker_id = %s
+            """,
+            (model, list(place_ids), worker_id),
+        )
+    conn.commit()
+
+
+def run_worker(conn: psycopg.Connection, args: argparse.Namespace, client: EmbeddingClient,
+               dims: int) -> Tuple[int, Optional[Exception]]:
+    model = client.model
+    worker_id = args.worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    done = 0
+    while done < args.limit:
+        rows = claim_batch(conn, model, worker_id, args.fetch_size, args.lease_seconds, args.max_attempts)
+        if not rows:
+            break
+
+        claimed_ids = [place_id for place_id, _ in rows]
+        try:
+            embedded, errors = embed_rows(
+                client,
+                rows,
+                dims,
+                on_request=lambda: renew_lease(conn, model, worker_id, claimed_ids, args.lease_seconds),
+            )
+        except requests.RequestException as e:
+            release_claims(conn, model, worker_id, claimed_ids)
+            return done, e
+        if errors:
+            fail_rows(conn, model, worker_id, errors)
+
+        completed = complete_batch(conn, model, worker_id, [pid for pid, _ in embedded], [vec for _, vec in embedded])
+        if completed < len(embedded):
+            print(f"{worker_id}: lost {len(embedded) - completed} rows to lease expiry or requeue")
+        done += completed
+        print(f"{worker_id}: embedded {done} ({client.metrics_line()})")
+    return done, None
+
+
+def print_queue_status(conn: psycopg.Connection, model: str) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT
+              count(*) FILTER (WHERE status = 'pending'),
+              count(*) FILTER (WHERE status = 'claimed' AND lease_until >= now()),
+              count(*) FILTER (WHERE status = 'claimed' AND lease_until < now()),
+              count(*) FILTER (WHERE status = 'done'),
+              count(*) FILTER (WHERE status = 'failed'),
+              count(*)
+            FROM search.embedding_queue
+            WHERE model = %s
+            """,
+            (model,),
+        )
+        pending, claimed, expired, done, failed, total = cur.fetchone()
+        cur.execute(
+            """
+            SELECT worker_id,
+                   count(*) AS done,
+                   EXTRACT(EPOCH FROM max(done_at) - min(claimed_at)) AS elapsed_s,
+                   max(done_at) AS last_done_at
+            FROM search.embedding_queue
+            WHERE model = %s AND status = 'done'
+            GROUP BY worker_id
+            ORDER BY worker_id
+            """,
+            (model,),
+        )
+        workers = cur.fetchall()
+        cur.execute(
+            """
+            SELECT place_id, attempts, last_error
+            FROM search.embedding_queue
+            WHERE model = %s AND status = 'failed'
+            ORDER BY place_id
+            LIMIT 20
+            """,
+            (model,),
+        )
+        failures = cur.fetchall()
+
+    progress = done / total * 100 if total else 0.0
+    print(f"model: {model}")
+    print(
+        f"pending: {pending} / claimed: {claimed} / lease_expired: {expired} / done: {done} "
+        f"/ failed: {failed} / total: {total}"
+    )
+    print(f"progress: {progress:.1f}%")
+    print("worker_id | done | places/s | last_done_at")
+    print("-" * 80)
+    for worker_id, count, elapsed_s, last_done_at in workers:
+        rate = count / float(elapsed_s) if elapsed_s else 0.0
+        print(f"{worker_id} | {count} | {rate:.2f} | {last_done_at}")
+    if failures:
+        print()
+        print("failed place_id | attempts | last_error")
+        print("-" * 80)
+        for place_id, attempts, last_error in failures:
+            print(f"{place_id} | {attempts} | {last_error}")
 
 
 def main() -> None:
@@ -54,45 +332,94 @@ def main() -> None:
     ap.add_argument("--dsn", default=os.environ.get("DATABASE_URL"))
     ap.add_argument("--ollama-url", default=os.environ.get("OLLAMA_URL", "http://localhost:11434"))
     ap.add_argument("--config", default="config/embedding.yml")
-    ap.add_argument("--batch-size", type=int, default=16)
+    ap.add_argument("--batch-size", type=int, default=16, help="initial request batch size (adapted at runtime)")
+    ap.add_argument("--max-batch-size", type=int, default=256)
+    ap.add_argument("--fetch-size", type=int, default=256, help="places read (or claimed) from the DB per round")
+    ap.add_argument("--target-latency", type=float, default=2.0, help="target seconds per embedding request")
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--max-retries", type=int, default=3)
     ap.add_argument("--limit", type=int, default=100000)
     ap.add_argument("--force", action="store_true")
+    ap.add_argument("--enqueue", action="store_true", help="fill search.embedding_queue and exit")
+    ap.add_argument("--worker", action="store_true", help="claim batches from search.embedding_queue")
+    ap.add_argument("--status", action="store_true", help="show queue progress and per-worker throughput")
+    ap.add_argument("--worker-id", default="")
+    ap.add_argument("--lease-seconds", type=int, default=300)
+    ap.add_argument("--max-attempts", type=int, default=3, help="claims per place before it is marked failed")
     args = ap.parse_args()
 
     if not args.dsn:
         raise SystemExit("DATABASE_URL is required")
 
     model, dims = load_embedding_config(args.config)
+    client = EmbeddingClient(
+        args.ollama_url,
+        model,
+        batch_size=args.batch_size,
+        max_batch_size=args.max_batch_size,
+        target_latency_s=args.target_latency,
+        timeout_s=args.timeout,
+        max_retries=args.max_retries,
+    )
+
+    if args.worker and args.lease_seconds <= client.max_request_window_s():
+        # The lease is renewed before every request, so it only has to outlive one of them.
+        raise SystemExit(
+            f"--lease-seconds ({args.lease_seconds}) must exceed one request window "
+            f"({client.max_request_window_s():.0f}s = --timeout + longest backoff)"
+        )
 
     with psycopg.connect(args.dsn) as conn:
+        if args.status:
+            print_queue_status(conn, model)
+            return
+
+        if args.enqueue:
+            print(f"enqueued: {enqueue_places(conn, model, args.force)}")
+            return
+
+        if args.worker:
+            done, outage = run_worker(conn, args, client, dims)
+            if done:
+                with conn.cursor() as cur:
+                    result_cache.bump_data_version(cur)
+                conn.commit()
+            if outage is not None:
+                raise SystemExit(f"embedding endpoint unavailable, released claimed rows after {done} places: {outage}")
+            return
+
         offset = 0
+        last_id = 0
+        outage = None
         while True:
-            rows = fetch_places(conn, model, args.batch_size, args.force)
+            rows = fetch_places(conn, model, args.fetch_size, args.force, last_id)
             if not rows:
                 break
 
-            place_ids, texts = zip(*rows)
-            embeddings = ollama_embed(args.ollama_url, model, list(texts))
-            if any(len(vec) != dims for vec in embeddings):
-                raise SystemExit("Embedding dimension mismatch")
-
-            with conn.cursor() as cur:
-                for place_id, vec in zip(place_ids, embeddings):
-                    cur.execute(
-                        """
-                        INSERT INTO search.place_embeddings (place_id, model, embedding)
-                        VALUES (%s, %s, %s)
-                        ON CONFLICT (place_id, model) DO UPDATE
-                        SET embedding = EXCLUDED.embedding, created_at = now()
-                        """,
-                        (place_id, model, to_pgvector_literal(vec)),
-                    )
+            try:
+                embedded, _ = embed_rows(client, rows, dims)
+            except requests.RequestException as e:
+                # The endpoint is down, not the texts: stop without moving
+                # past these rows so the next run picks them up again.
+                outage = e
+                break
+            last_id = rows[-1][0]
+            write_embeddings(conn, model, [pid for pid, _ in embedded], [vec for _, vec in embedded])
             conn.commit()
 
             offset += len(rows)
+            print(f"embedded {offset} ({client.metrics_line()})")
             if offset >= args.limit:
                 break
 
+        if offset:
+            with conn.cursor() as cur:
+                result_cache.bump_data_version(cur)
+            conn.commit()
+
+        if outage is not None:
+            raise SystemExit(f"embedding endpoint unavailable, stopped after {offset} places: {outage}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,171 @@
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class EmbeddingClient:
+    """Ollama /api/embed client shared by the CLI scripts.
+
+    Texts are sorted by length and sent in buckets so one request does not mix
+    short names with long tag-rich strings. The batch size follows the measured
+    latency toward target_latency_s and is halved on a timeout. Failed requests
+    are retried with backoff. A batch rejected because of its input (4xx other
+    than 408/429, or a timeout) is split in half until the bad text is isolated,
+    and only that text is reported as failed. Errors that point at the endpoint
+    (connection errors, 5xx/408/429 after the retries) are raised instead.
+    """
+
+    def __init__(self, ollama_url: str, model: str, batch_size: int = 16, min_batch_size: int = 1,
+                 max_batch_size: int = 256, target_latency_s: float = 2.0, timeout_s: float = 120,
+                 max_retries: int = 3, backoff_s: float = 1.0) -> None:
+        self.url = f"{ollama_url.rstrip('/')}/api/embed"
+        self.model = model
+        self.batch_size = max(min_batch_size, min(batch_size, max_batch_size))
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_latency_s = target_latency_s
+        self.timeout_s = timeout_s
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.session = requests.Session()
+        self.texts = 0
+        self.tokens = 0
+        self.requests = 0
+        self.retries = 0
+        self.splits = 0
+        self.failed = 0
+        self.elapsed_s = 0.0
+        self.on_request: Optional[Callable[[], None]] = None
+
+    def embed_one(self, text: str) -> List[float]:
+        return self._post_with_retry([text])[0]
+
+    def embed(self, texts: Sequence[str],
+              on_request: Optional[Callable[[], None]] = None) -> Tuple[List[Optional[List[float]]], Dict[int, str]]:
+        """Embed texts, returning vectors in input order and {index: error} for failures.
+
+        Failed texts get None instead of a vector. on_request is called before
+        every HTTP request (e.g. to renew a queue lease).
+        """
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        failures: Dict[int, str] = {}
+        self.on_request = on_request
+        try:
+            pos = 0
+            while pos < len(order):
+                bucket = order[pos:pos + self.batch_size]
+                results = self._embed_batch([texts[i] for i in bucket])
+                for i, (vec, error) in zip(bucket, results):
+                    out[i] = vec
+                    if error is not None:
+                        failures[i] = error
+                pos += len(bucket)
+        finally:
+            self.on_request = None
+        return out, failures
+
+    def max_request_window_s(self) -> float:
+        """Longest gap between two on_request calls: one timeout plus the longest backoff."""
+        return self.timeout_s + self.backoff_s * 2 ** max(self.max_retries - 1, 0)
+
+    def metrics(self) -> Dict[str, float]:
+        elapsed = self.elapsed_s or 1e-9
+        return {
+            "texts": self.texts,
+            "tokens": self.tokens,
+            "requests": self.requests,
+            "retries": self.retries,
+            "splits": self.splits,
+            "failed": self.failed,
+            "batch_size": self.batch_size,
+            "texts_per_s": self.texts / elapsed,
+            "tokens_per_s": self.tokens / elapsed,
+        }
+
+    def metrics_line(self) -> str:
+        m = self.metrics()
+        return (
+            f"texts={m['texts']} tokens={m['tokens']} texts/s={m['texts_per_s']:.1f} "
+            f"tokens/s={m['tokens_per_s']:.1f} batch_size={m['batch_size']} "
+            f"requests={m['requests']} retries={m['retries']} splits={m['splits']} failed={m['failed']}"
+        )
+
+    @staticmethod
+    def _is_input_error(e: requests.RequestException) -> bool:
+        if isinstance(e, requests.Timeout) and not isinstance(e, requests.ConnectTimeout):
+            return True
+        status = e.response.status_code if e.response is not None else None
+        return status is not None and 400 <= status < 500 and status not in RETRYABLE_STATUS
+
+    def _embed_batch(self, texts: List[str]) -> List[Tuple[Optional[List[float]], Optional[str]]]:
+        try:
+            return [(vec, None) for vec in self._post_with_retry(texts)]
+        except requests.RequestException as e:
+            if not self._is_input_error(e):
+                raise
+            if len(texts) == 1:
+                self.failed += 1
+                return [(None, str(e))]
+            self.splits += 1
+            mid = len(texts) // 2
+            return self._embed_batch(texts[:mid]) + self._embed_batch(texts[mid:])
+
+    def _post_with_retry(self, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            try:
+                return self._post(texts)
+            except requests.ConnectTimeout:
+                if attempt >= self.max_retries:
+                    raise
+            except requests.Timeout:
+                # A timeout means the batch is too big for the endpoint: shrink
+                # future buckets and let _embed_batch split this one right away
+                # instead of waiting out every retry at full size.
+                self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+                if len(texts) > 1 or attempt >= self.max_retries:
+                    raise
+            except requests.RequestException as e:
+                status = e.response.status_code if e.response is not None else None
+                if attempt >= self.max_retries or (status is not None and status not in RETRYABLE_STATUS):
+                    raise
+            attempt += 1
+            self.retries += 1
+            time.sleep(self.backoff_s * (2 ** (attempt - 1)))
+
+    def _post(self, texts: List[str]) -> List[List[float]]:
+        if self.on_request is not None:
+            self.on_request()
+        started = time.perf_counter()
+        r = self.session.post(
+            self.url,
+            json={"model": self.model, "input": texts},
+            timeout=self.timeout_s,
+        )
+        r.raise_for_status()
+        body = r.json()
+        latency = time.perf_counter() - started
+
+        embeddings = body["embeddings"]
+        if len(embeddings) != len(texts):
+            raise requests.RequestException(f"expected {len(texts)} embeddings, got {len(embeddings)}")
+
+        self.requests += 1
+        self.texts += len(texts)
+        self.tokens += int(body.get("prompt_eval_count", 0))
+        self.elapsed_s += latency
+        self._adapt(len(texts), latency)
+        return embeddings
+
+    def _adapt(self, sent: int, latency: float) -> None:
+        # Only full batches say anything about whether the batch size fits the target.
+        if sent < self.batch_size or latency <= 0:
+            return
+        scaled = int(self.batch_size * self.target_latency_s / latency)
+        # Grow at most 2x per step, shrink as far as the measurement says.
+        new_size = min(scaled, self.batch_size * 2)
+        self.batch_size = max(self.min_batch_size, min(new_size, self.max_batch_size))
@@ -5,24 +5,15 @@ import os
 from typing import Dict, List, Tuple
 
 import psycopg
-import requests
 import yaml
 
+from embedding_client import EmbeddingClient
+
 
 def to_pgvector_literal(vec: List[float]) -> str:
     return "[" + ",".join(f"{x:.8f}" for x in vec) + "]"
 
 
-def ollama_embed_one(ollama_url: str, model: str, text: str) -> List[float]:
-    r = requests.post(
-        f"{ollama_url.rstrip('/')}/api/embed",
-        json={"model": model, "input": text},
-        timeout=60,
-    )
-    r.raise_for_status()
-    return r.json()["embeddings"][0]
-
-
 def load_embedding_config(path: str) -> Tuple[str, int]:
     with open(path, "r", encoding="utf-8") as f:
         cfg = yaml.safe_load(f)
@@ -191,11 +182,13 @@ def main() -> None:
     queries = load_queries(args.queries)
     qrels = load_qrels(args.qrels)
 
+    client = EmbeddingClient(args.ollama_url, model, timeout_s=60)
+
     results = []
     with psycopg.connect(args.dsn) as conn:
         for q in queries:
             qid = str(q["id"])
-            qvec = ollama_embed_one(args.ollama_url, model, q["query"])
+            qvec = client.embed_one(q["query"])
             ranked = search(
                 conn,
                 q["query"],
@@ -231,6 +224,7 @@ def main() -> None:
 
     print(json.dumps(avg, ensure_ascii=False, indent=2))
     print(f"saved: {out_path}")
+    print(f"embedding: {client.metrics_line()}")
 
 
 if __name__ == "__main__":
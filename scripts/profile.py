@@ -4,24 +4,15 @@ import os
 from typing import Any, Dict, List, Tuple
 
 import psycopg
-import requests
 import yaml
 
+from embedding_client import EmbeddingClient
+
 
 def to_pgvector_literal(vec: List[float]) -> str:
     return "[" + ",".join(f"{x:.8f}" for x in vec) + "]"
 
 
-def ollama_embed_one(ollama_url: str, model: str, text: str) -> List[float]:
-    r = requests.post(
-        f"{ollama_url.rstrip('/')}/api/embed",
-        json={"model": model, "input": text},
-        timeout=60,
-    )
-    r.raise_for_status()
-    return r.json()["embeddings"][0]
-
-
 def load_embedding_config(path: str) -> Tuple[str, int]:
     with open(path, "r", encoding="utf-8") as f:
         cfg = yaml.safe_load(f)
@@ -52,7 +43,7 @@ def main() -> None:
 
     model, dims = load_embedding_config(args.embedding_config)
     scenario = load_scenario(args.evaluation_config, args.scenario)
-    qvec = ollama_embed_one(args.ollama_url, model, args.query)
+    qvec = EmbeddingClient(args.ollama_url, model, timeout_s=60).embed_one(args.query)
     if len(qvec) != dims:
         raise SystemExit("Embedding dimension mismatch")
 
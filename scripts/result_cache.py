@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg
+
+
+def normalize_query(query: str) -> str:
+    text = unicodedata.normalize("NFKC", query)
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+METERS_PER_DEG_LAT = 111320.0
+
+
+def snap_point(lat: float, lon: float, radius_m: float, cell_ratio: float = 0.1) -> Tuple[float, float]:
+    # Snap to the center of a grid cell about radius_m * cell_ratio wide so nearby
+    # requests share a cache entry while the shift stays a small share of the radius.
+    cell_m = radius_m * cell_ratio
+    if cell_m <= 0:
+        return lat, lon
+    lat_step = cell_m / METERS_PER_DEG_LAT
+    snapped_lat = (math.floor(round(lat / lat_step, 9)) + 0.5) * lat_step
+    # The longitude step comes from the snapped row's latitude so every point in
+    # the row lands on the same grid.
+    cos_lat = max(math.cos(math.radians(snapped_lat)), 1e-6)
+    lon_step = min(cell_m / (METERS_PER_DEG_LAT * cos_lat), 360.0)
+    snapped_lon = (math.floor(round(lon / lon_step, 9)) + 0.5) * lon_step
+    return round(snapped_lat, 6), round(snapped_lon, 6)
+
+
+def build_geo_key(region: str, lat: Optional[float], lon: Optional[float], radius_m: float) -> str:
+    if region:
+        return f"region:{region}"
+    if lat is not None and lon is not None:
+        return f"cell:{lat:.6f},{lon:.6f}:r{radius_m:g}"
+    return "all"
+
+
+def build_cache_key(model: str, ollama_url: str, scenario: str, scenario_cfg: Dict[str, Any],
+                    query_norm: str, geo_key: str, limit: int) -> str:
+    # The scenario contents (weights, candidate sizes) are part of the key so
+    # editing config/evaluation.yml never serves results ranked the old way.
+    scenario_json = json.dumps(scenario_cfg, sort_keys=True, ensure_ascii=False, default=str)
+    raw = "\x1f".join([model, ollama_url.rstrip("/"), scenario, scenario_json, query_norm, geo_key, str(limit)])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def bump_data_version(cur: psycopg.Cursor) -> None:
+    # DBs initialized before 060_result_cache.sql have no version counter; they
+    # have no cache to invalidate either, so the bump is simply skipped there.
+    cur.execute("SELECT to_regproc('search.bump_data_version') IS NOT NULL")
+    if cur.fetchone()[0]:
+        cur.execute("SELECT search.bump_data_version();")
+
+
+def current_data_version(conn: psycopg.Connection) -> int:
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM search.data_version WHERE id = 1")
+        row = cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+def lookup(conn: psycopg.Connection, cache_key: str, data_version: int, ttl_s: int) -> Optional[Tuple[List[Any], float]]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE search.result_cache
+            SET hits = hits + 1, last_hit_at = now()
+            WHERE cache_key = %s
+              AND data_version = %s
+              AND created_at > now() - make_interval(secs => %s)
+            RETURNING results, compute_ms
+            """,
+            (cache_key, data_version, ttl_s),
+        )
+        row = cur.fetchone()
+    conn.commit()
+    if row is None:
+        return None
+    return row[0], float(row[1])
+
+
+def record_hit(conn: psycopg.Connection, saved_ms: float) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE search.result_cache_stats SET hits = hits + 1, saved_ms = saved_ms + %s WHERE id = 1",
+            (max(saved_ms, 0.0),),
+        )
+    conn.commit()
+
+
+def store(conn: psycopg.Connection, cache_key: str, data_version: int, query_norm: str, scenario: str,
+          geo_key: str, rows: List[Any], compute_ms: float, ttl_s: int, max_entries: int) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO search.result_cache
+              (cache_key, data_version, query_norm, scenario, geo_key, results, compute_ms)
+            VALUES (%s, %s, %s, %s, %s, %s::jsonb, %s)
+            ON CONFLICT (cache_key) DO UPDATE
+            SET data_version = EXCLUDED.data_version,
+                results = EXCLUDED.results,
+                compute_ms = EXCLUDED.compute_ms,
+                hits = 0,
+                created_at = now(),
+                last_hit_at = now()
+            """,
+            (
+                cache_key,
+                data_version,
+                query_norm,
+                scenario,
+                geo_key,
+                json.dumps(rows, ensure_ascii=False, default=float),
+                compute_ms,
+            ),
+        )
+        # Older data versions and expired entries first, then LRU down to max_entries.
+        # Only strictly older versions: a caller that read the version just before
+        # a bump must not wipe entries other processes stored under the new one.
+        cur.execute(
+            """
+            DELETE FROM search.result_cache
+            WHERE data_version < %s
+               OR created_at <= now() - make_interval(secs => %s)
+            """,
+            (data_version, ttl_s),
+        )
+        evicted = cur.rowcount
+        cur.execute(
+            """
+            DELETE FROM search.result_cache
+            WHERE cache_key IN (
+              SELECT cache_key FROM search.result_cache
+              ORDER BY last_hit_at DESC
+              OFFSET %s
+            )
+            """,
+            (max_entries,),
+        )
+        evicted += cur.rowcount
+        cur.execute(
+            "UPDATE search.result_cache_stats SET misses = misses + 1, evictions = evictions + %s WHERE id = 1",
+            (evicted,),
+        )
+    conn.commit()
+
+
+def print_stats(conn: psycopg.Connection) -> None:
+    with conn.cursor() as cur:
+        cur.execute("SELECT hits, misses, saved_ms, evictions FROM search.result_cache_stats WHERE id = 1")
+        hits, misses, saved_ms, evictions = cur.fetchone()
+        cur.execute("SELECT count(*) FROM search.result_cache")
+        (entries,) = cur.fetchone()
+    total = hits + misses
+    ratio = hits / total if total else 0.0
+    print(f"data_version: {current_data_version(conn)}")
+    print(f"entries: {entries}")
+    print(f"hits: {hits} / misses: {misses} / hit_ratio: {ratio:.3f}")
+    print(f"saved_ms: {saved_ms:.1f} (avg {saved_ms / hits if hits else 0.0:.1f} ms per hit)")
+    print(f"evictions: {evictions}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Inspect or clear the hybrid search result cache")
+    ap.add_argument("command", choices=["stats", "clear"])
+    ap.add_argument("--dsn", default=os.environ.get("DATABASE_URL"))
+    args = ap.parse_args()
+
+    if not args.dsn:
+        raise SystemExit("DATABASE_URL is required")
+
+    with psycopg.connect(args.dsn) as conn:
+        if args.command == "clear":
+            with conn.cursor() as cur:
+                cur.execute("TRUNCATE search.result_cache;")
+                cur.execute("UPDATE search.result_cache_stats SET hits = 0, misses = 0, saved_ms = 0, evictions = 0;")
+            conn.commit()
+            print("result cache cleared")
+            return
+        print_stats(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,20 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import time
 from typing import Any, Dict, List, Tuple
 
 import psycopg
-import requests
 import yaml
 
+import result_cache
+from embedding_client import EmbeddingClient
+
 
 def to_pgvector_literal(vec: List[float]) -> str:
     return "[" + ",".join(f"{x:.8f}" for x in vec) + "]"
 
 
-def ollama_embed_one(ollama_url: str, model: str, text: str) -> List[float]:
-    r = requests.post(
-        f"{ollama_url.rstrip('/')}/api/embed",
-        json={"model": model, "input": text},
-        timeout=60,
-    )
-    r.raise_for_status()
-    return r.json()["embeddings"][0]
-
-
 def load_embedding_config(path: str) -> Tuple[str, int]:
     with open(path, "r", encoding="utf-8") as f:
         cfg = yaml.safe_load(f)
@@ -71,32 +64,14 @@ def build_geo_cte(region: str, lat: float, lon: float, radius_m: float) -> Tuple
     return cte, params
 
 
-def main() -> None:
-    ap = argparse.ArgumentParser(description="Geo + text + vector search CLI")
-    ap.add_argument("--query", required=True)
-    ap.add_argument("--region", default="")
-    ap.add_argument("--lat", type=float)
-    ap.add_argument("--lon", type=float)
-    ap.add_argument("--radius", type=float, default=3000)
-    ap.add_argument("--limit", type=int, default=20)
-    ap.add_argument("--scenario", default="S3_geo_text_vector")
-    ap.add_argument("--evaluation-config", default="config/evaluation.yml")
-    ap.add_argument("--embedding-config", default="config/embedding.yml")
-    ap.add_argument("--dsn", default=os.environ.get("DATABASE_URL"))
-    ap.add_argument("--ollama-url", default=os.environ.get("OLLAMA_URL", "http://localhost:11434"))
-    args = ap.parse_args()
-
-    if not args.dsn:
-        raise SystemExit("DATABASE_URL is required")
-
-    model, dims = load_embedding_config(args.embedding_config)
-    scenario = load_scenario(args.evaluation_config, args.scenario)
-
-    qvec = ollama_embed_one(args.ollama_url, model, args.query)
+def run_search(conn: psycopg.Connection, args: argparse.Namespace, client: EmbeddingClient, dims: int,
+               scenario: Dict[str, Any], lat: float, lon: float) -> List[Tuple[Any, ...]]:
+    model = client.model
+    qvec = client.embed_one(args.query)
     if len(qvec) != dims:
         raise SystemExit(f"Expected {dims}-dim embedding, got {len(qvec)}")
 
-    geo_cte, geo_params = build_geo_cte(args.region, args.lat, args.lon, args.radius)
+    geo_cte, geo_params = build_geo_cte(args.region, lat, lon, args.radius)
 
     candidates = scenario.get("candidates", {})
     text_k = candidates.get("text_k", 50)
@@ -171,16 +146,77 @@ def main() -> None:
     }
     params.update(geo_params)
 
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Geo + text + vector search CLI")
+    ap.add_argument("--query", required=True)
+    ap.add_argument("--region", default="")
+    ap.add_argument("--lat", type=float)
+    ap.add_argument("--lon", type=float)
+    ap.add_argument("--radius", type=float, default=3000)
+    ap.add_argument("--limit", type=int, default=20)
+    ap.add_argument("--scenario", default="S3_geo_text_vector")
+    ap.add_argument("--evaluation-config", default="config/evaluation.yml")
+    ap.add_argument("--embedding-config", default="config/embedding.yml")
+    ap.add_argument("--dsn", default=os.environ.get("DATABASE_URL"))
+    ap.add_argument("--ollama-url", default=os.environ.get("OLLAMA_URL", "http://localhost:11434"))
+    ap.add_argument("--cache", action="store_true", help="serve repeated queries from search.result_cache")
+    ap.add_argument("--cache-ttl", type=int, default=3600)
+    ap.add_argument("--cache-max-entries", type=int, default=10000)
+    ap.add_argument("--cache-cell-ratio", type=float, default=0.1,
+                    help="snap cell size for cache keys, as a fraction of --radius")
+    args = ap.parse_args()
+
+    if not args.dsn:
+        raise SystemExit("DATABASE_URL is required")
+
+    model, dims = load_embedding_config(args.embedding_config)
+    scenario = load_scenario(args.evaluation_config, args.scenario)
+    client = EmbeddingClient(args.ollama_url, model, timeout_s=60)
+
+    lat, lon = args.lat, args.lon
+    if args.cache and not args.region and lat is not None and lon is not None:
+        lat, lon = result_cache.snap_point(lat, lon, args.radius, args.cache_cell_ratio)
+
     with psycopg.connect(args.dsn) as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql, params)
-            rows = cur.fetchall()
+        if not args.cache:
+            rows = run_search(conn, args, client, dims, scenario, lat, lon)
+        else:
+            query_norm = result_cache.normalize_query(args.query)
+            geo_key = result_cache.build_geo_key(args.region, lat, lon, args.radius)
+            cache_key = result_cache.build_cache_key(
+                model, args.ollama_url, args.scenario, scenario, query_norm, geo_key, args.limit
+            )
+            data_version = result_cache.current_data_version(conn)
+
+            started = time.perf_counter()
+            cached = result_cache.lookup(conn, cache_key, data_version, args.cache_ttl)
+            lookup_ms = (time.perf_counter() - started) * 1000
+            if cached is not None:
+                rows, compute_ms = cached
+                result_cache.record_hit(conn, compute_ms - lookup_ms)
+                cache_line = f"cache: hit ({lookup_ms:.1f} ms, saved {compute_ms - lookup_ms:.1f} ms)"
+            else:
+                started = time.perf_counter()
+                rows = run_search(conn, args, client, dims, scenario, lat, lon)
+                compute_ms = (time.perf_counter() - started) * 1000
+                result_cache.store(
+                    conn, cache_key, data_version, query_norm, args.scenario, geo_key,
+                    [list(r) for r in rows], compute_ms, args.cache_ttl, args.cache_max_entries,
+                )
+                cache_line = f"cache: miss ({compute_ms:.1f} ms)"
 
     print("place_id | name | category | dist_m | s_text | s_vec | final_score")
     print("-" * 120)
     for row in rows:
         place_id, name, category, dist_m, s_text, s_vec, final_score = row
         print(f"{place_id} | {name} | {category} | {dist_m} | {s_text} | {s_vec} | {final_score}")
+    if args.cache:
+        print(cache_line)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,23 @@
 #!/usr/bin/env python3
 import argparse
+import gzip
 import os
-from typing import Dict, List
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Set, Tuple
 
 import psycopg
 import yaml
 
+import result_cache
+
 RAW_TABLES = {
     "osm_points": "geom",
     "osm_lines": "ST_LineInterpolatePoint(geom, 0.5)",
     "osm_polygons": "ST_PointOnSurface(geom)",
 }
 
+OSC_TYPES = {"node", "way", "relation"}
+
 
 def load_rules(path: str, mode: str) -> List[Dict[str, object]]:
     with open(path, "r", encoding="utf-8") as f:
@@ -21,6 +27,12 @@ def load_rules(path: str, mode: str) -> List[Dict[str, object]]:
     return config[mode]
 
 
+def load_embedding_model(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    return cfg["model"]
+
+
 def build_match_sql(table_alias: str, match: Dict[str, object]) -> str:
     key = match["key"]
     values = match.get("values", [])
@@ -30,57 +42,183 @@ def build_match_sql(table_alias: str, match: Dict[str, object]) -> str:
     return f"({table_alias}.tags ? '{key}' AND {table_alias}.tags->>'{key}' IN ({values_sql}))"
 
 
+def build_upsert_sql(table: str, point_expr: str, match_sql: str, touched_only: bool) -> str:
+    touched_sql = "AND (r.osm_type, r.osm_id) IN (SELECT osm_type, osm_id FROM touched)" if touched_only else ""
+    returning_sql = "RETURNING place_id" if touched_only else ""
+    return f"""
+    INSERT INTO search.places (osm_type, osm_id, name, category, tags, geom, point, geog, text_for_search)
+    SELECT
+      r.osm_type,
+      r.osm_id,
+      COALESCE(r.tags->>'name', r.tags->>'name:ja') AS name,
+      %s AS category,
+      r.tags,
+      ST_Transform(r.geom, 4326) AS geom,
+      ST_Transform({point_expr}, 4326) AS point,
+      ST_Transform({point_expr}, 4326)::geography AS geog,
+      search.build_text_for_search(COALESCE(r.tags->>'name', r.tags->>'name:ja'), r.tags) AS text_for_search
+    FROM raw.{table} r
+    WHERE ({match_sql})
+      {touched_sql}
+    ON CONFLICT (osm_type, osm_id) DO UPDATE
+    SET name = EXCLUDED.name,
+        category = EXCLUDED.category,
+        tags = EXCLUDED.tags,
+        geom = EXCLUDED.geom,
+        point = EXCLUDED.point,
+        geog = EXCLUDED.geog,
+        text_for_search = EXCLUDED.text_for_search
+    {returning_sql}
+    """
+
+
+def load_osc_ids(paths: List[str]) -> Set[Tuple[str, int]]:
+    ids: Set[Tuple[str, int]] = set()
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            for _, elem in ET.iterparse(f):
+                if elem.tag in OSC_TYPES:
+                    ids.add((elem.tag, int(elem.get("id"))))
+                    elem.clear()
+    return ids
+
+
+def transform_full(cur: psycopg.Cursor, rules: List[Dict[str, object]]) -> None:
+    for rule in rules:
+        category = rule["category"]
+        matches = rule.get("match", [])
+        if not matches:
+            continue
+
+        match_sql = " OR ".join([build_match_sql("r", m) for m in matches])
+
+        for table, point_expr in RAW_TABLES.items():
+            cur.execute(build_upsert_sql(table, point_expr, match_sql, False), (category,))
+
+
+def transform_changes(cur: psycopg.Cursor, rules: List[Dict[str, object]], osc_ids: Set[Tuple[str, int]],
+                      model: str) -> Dict[str, int]:
+    cur.execute(
+        """
+        CREATE TEMP TABLE touched (osm_type text, osm_id bigint, PRIMARY KEY (osm_type, osm_id)) ON COMMIT DROP;
+        CREATE TEMP TABLE kept (place_id bigint PRIMARY KEY) ON COMMIT DROP;
+        """
+    )
+    with cur.copy("COPY touched (osm_type, osm_id) FROM STDIN") as copy:
+        for osm_type, osm_id in osc_ids:
+            copy.write_row((osm_type, osm_id))
+
+    # raw.osm_changes holds the objects osm2pgsql re-processed in append mode,
+    # e.g. ways whose geometry moved because one of their nodes did.
+    cur.execute(
+        """
+        INSERT INTO touched (osm_type, osm_id)
+        SELECT DISTINCT osm_type, osm_id FROM raw.osm_changes
+        ON CONFLICT DO NOTHING
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TEMP TABLE touched_before ON COMMIT DROP AS
+        SELECT p.place_id, p.text_for_search
+        FROM search.places p
+        JOIN touched t USING (osm_type, osm_id);
+        """
+    )
+
+    for rule in rules:
+        category = rule["category"]
+        matches = rule.get("match", [])
+        if not matches:
+            continue
+
+        match_sql = " OR ".join([build_match_sql("r", m) for m in matches])
+
+        for table, point_expr in RAW_TABLES.items():
+            upsert_sql = build_upsert_sql(table, point_expr, match_sql, True)
+            cur.execute(
+                f"""
+                WITH up AS ({upsert_sql})
+                INSERT INTO kept SELECT place_id FROM up
+                ON CONFLICT DO NOTHING
+                """,
+                (category,),
+            )
+
+    # Touched places that no longer exist in raw (or no longer match a rule).
+    cur.execute(
+        """
+        DELETE FROM search.places p
+        USING touched_before b
+        WHERE p.place_id = b.place_id
+          AND NOT EXISTS (SELECT 1 FROM kept k WHERE k.place_id = p.place_id)
+        """
+    )
+    deleted = cur.rowcount
+
+    cur.execute(
+        """
+        INSERT INTO search.embedding_queue (place_id, model)
+        SELECT p.place_id, %s
+        FROM kept k
+        JOIN search.places p USING (place_id)
+        LEFT JOIN touched_before b USING (place_id)
+        WHERE b.place_id IS NULL
+           OR b.text_for_search IS DISTINCT FROM p.text_for_search
+        ON CONFLICT (place_id, model) DO UPDATE
+        SET status = 'pending', worker_id = NULL, lease_until = NULL, attempts = 0, last_error = NULL,
+            enqueued_at = now()
+        """,
+        (model,),
+    )
+    queued = cur.rowcount
+
+    cur.execute("TRUNCATE raw.osm_changes;")
+
+    cur.execute("SELECT count(*) FROM touched")
+    touched = cur.fetchone()[0]
+    cur.execute("SELECT count(*) FROM kept")
+    upserted = cur.fetchone()[0]
+    cur.execute("DROP TABLE touched, kept, touched_before;")
+    return {"touched": touched, "upserted": upserted, "deleted": deleted, "queued": queued}
+
+
 def main() -> None:
     ap = argparse.ArgumentParser(description="Transform raw OSM tables into search.places")
     ap.add_argument("--dsn", default=os.environ.get("DATABASE_URL"))
     ap.add_argument("--config", default="config/place_extract.yml")
     ap.add_argument("--mode", default="focused")
     ap.add_argument("--reset", action="store_true")
+    ap.add_argument("--osc", action="append", default=[], help="only transform objects touched by this .osc(.gz); repeatable")
+    ap.add_argument("--embedding-config", default="config/embedding.yml")
     args = ap.parse_args()
 
     if not args.dsn:
         raise SystemExit("DATABASE_URL is required")
 
+    if args.osc and args.reset:
+        raise SystemExit("--reset cannot be combined with --osc")
+
     rules = load_rules(args.config, args.mode)
 
     with psycopg.connect(args.dsn) as conn:
         with conn.cursor() as cur:
             if args.reset:
-                cur.execute("TRUNCATE search.place_embeddings, search.places RESTART IDENTITY;")
-
-            for rule in rules:
-                category = rule["category"]
-                matches = rule.get("match", [])
-                if not matches:
-                    continue
-
-                match_sql = " OR ".join([build_match_sql("r", m) for m in matches])
-
-                for table, point_expr in RAW_TABLES.items():
-                    sql = f"""
-                    INSERT INTO search.places (osm_type, osm_id, name, category, tags, geom, point, geog, text_for_search)
-                    SELECT
-                      r.osm_type,
-                      r.osm_id,
-                      COALESCE(r.tags->>'name', r.tags->>'name:ja') AS name,
-                      %s AS category,
-                      r.tags,
-                      ST_Transform(r.geom, 4326) AS geom,
-                      ST_Transform({point_expr}, 4326) AS point,
-                      ST_Transform({point_expr}, 4326)::geography AS geog,
-                      search.build_text_for_search(COALESCE(r.tags->>'name', r.tags->>'name:ja'), r.tags) AS text_for_search
-                    FROM raw.{table} r
-                    WHERE {match_sql}
-                    ON CONFLICT (osm_type, osm_id) DO UPDATE
-                    SET name = EXCLUDED.name,
-                        category = EXCLUDED.category,
-                        tags = EXCLUDED.tags,
-                        geom = EXCLUDED.geom,
-                        point = EXCLUDED.point,
-                        geog = EXCLUDED.geog,
-                        text_for_search = EXCLUDED.text_for_search;
-                    """
-                    cur.execute(sql, (category,))
+                cur.execute("TRUNCATE search.embedding_queue, search.place_embeddings, search.places RESTART IDENTITY;")
+
+            if args.osc:
+                cur.execute("SELECT to_regclass('raw.osm_changes') IS NOT NULL")
+                if not cur.fetchone()[0]:
+                    raise SystemExit("raw.osm_changes is missing; run `make db-migrate` (or re-import) first")
+                model = load_embedding_model(args.embedding_config)
+                stats = transform_changes(cur, rules, load_osc_ids(args.osc), model)
+                print(" / ".join(f"{k}: {v}" for k, v in stats.items()))
+            else:
+                transform_full(cur, rules)
+
+            result_cache.bump_data_version(cur)
 
         conn.commit()
 
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Minimal stand-in for Ollama's /api/embed used by the tests.
+
+Vectors are derived from a hash of each input so they are deterministic.
+Every input that reaches the stub is recorded in ``received`` and every
+request's input list in ``batches``. Failures can be injected: a 400 for any
+request containing one of ``fail_inputs``, a 503 on every
+``unavailable_every``-th request, and a ``slow_delay_s`` sleep for requests
+larger than ``slow_over`` inputs.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, List, Optional
+
+
+def fake_vector(text: str, dims: int) -> List[float]:
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    return [seed[i % len(seed)] / 255.0 for i in range(dims)]
+
+
+class StubOllama:
+    def __init__(self, dims: int = 1024, delay_s: float = 0.0, port: int = 0,
+                 fail_inputs: Iterable[str] = (), unavailable_every: int = 0,
+                 slow_over: Optional[int] = None, slow_delay_s: float = 0.0) -> None:
+        self.dims = dims
+        self.delay_s = delay_s
+        self.fail_inputs = set(fail_inputs)
+        self.unavailable_every = unavailable_every
+        self.slow_over = slow_over
+        self.slow_delay_s = slow_delay_s
+        self.received: List[str] = []
+        self.batches: List[List[str]] = []
+        self.requests = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args: object) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                texts = body["input"]
+                if isinstance(texts, str):
+                    texts = [texts]
+                with stub.lock:
+                    stub.requests += 1
+                    request_no = stub.requests
+                if stub.unavailable_every and request_no % stub.unavailable_every == 0:
+                    self.send_error(503)
+                    return
+                if stub.fail_inputs.intersection(texts):
+                    self.send_error(400)
+                    return
+                if stub.slow_over is not None and len(texts) > stub.slow_over:
+                    time.sleep(stub.slow_delay_s)
+                    try:
+                        self.send_error(504)
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass  # the client already gave up
+                    return
+                with stub.lock:
+                    stub.received.extend(texts)
+                    stub.batches.append(list(texts))
+                if stub.delay_s:
+                    time.sleep(stub.delay_s)
+                payload = json.dumps(
+                    {
+                        "model": body.get("model"),
+                        "embeddings": [fake_vector(t, stub.dims) for t in texts],
+                        "prompt_eval_count": sum(len(t) for t in texts),
+                    }
+                ).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self) -> "StubOllama":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Stub Ollama /api/embed server")
+    ap.add_argument("--port", type=int, default=11500)
+    ap.add_argument("--dims", type=int, default=1024)
+    ap.add_argument("--delay", type=float, default=0.0)
+    args = ap.parse_args()
+
+    with StubOllama(dims=args.dims, delay_s=args.delay, port=args.port) as stub:
+        print(f"stub ollama listening on {stub.url}")
+        try:
+            stub.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
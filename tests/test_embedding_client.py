@@ -0,0 +1,112 @@
+import socket
+
+import pytest
+import requests
+
+from embedding_client import EmbeddingClient
+from stub_ollama import StubOllama, fake_vector
+
+
+def make_client(stub: StubOllama, **kwargs) -> EmbeddingClient:
+    kwargs.setdefault("backoff_s", 0.01)
+    return EmbeddingClient(stub.url, "stub", **kwargs)
+
+
+def test_embed_keeps_input_order_and_buckets_by_length():
+    texts = ["x" * n for n in (9, 1, 7, 3, 5, 2, 8, 4, 6)]
+    with StubOllama(dims=4) as stub:
+        client = make_client(stub, batch_size=3, target_latency_s=60)
+        vectors, failures = client.embed(texts)
+
+    assert failures == {}
+    assert vectors == [fake_vector(t, 4) for t in texts]
+    assert stub.batches[0] == ["x", "xx", "xxx"]
+    for batch in stub.batches:
+        assert [len(t) for t in batch] == sorted(len(t) for t in batch)
+
+
+def test_transient_errors_are_retried():
+    texts = [f"t{i}" for i in range(8)]
+    with StubOllama(dims=4, unavailable_every=2) as stub:
+        client = make_client(stub, batch_size=2, target_latency_s=60)
+        vectors, failures = client.embed(texts)
+
+    assert failures == {}
+    assert vectors == [fake_vector(t, 4) for t in texts]
+    assert client.retries > 0
+
+
+def test_bad_text_is_isolated_and_reported():
+    with StubOllama(dims=4, fail_inputs={"BAD"}) as stub:
+        client = make_client(stub, batch_size=4)
+        vectors, failures = client.embed(["x", "BAD", "yy", "zzz"])
+
+    assert list(failures) == [1]
+    assert vectors[1] is None
+    assert [vectors[i] for i in (0, 2, 3)] == [fake_vector(t, 4) for t in ("x", "yy", "zzz")]
+    assert client.metrics()["failed"] == 1
+
+
+def test_timeout_shrinks_batch_size():
+    texts = [f"t{i}" for i in range(8)]
+    with StubOllama(dims=4, slow_over=2, slow_delay_s=1.0) as stub:
+        client = make_client(stub, batch_size=8, timeout_s=0.2, target_latency_s=60)
+        vectors, failures = client.embed(texts)
+
+    assert failures == {}
+    assert vectors == [fake_vector(t, 4) for t in texts]
+    # Timed-out batches are split right away rather than retried at full size.
+    assert client.retries == 0
+    assert client.splits > 0
+    assert all(len(batch) <= 2 for batch in stub.batches)
+
+
+def test_batch_size_adapts_to_target_latency():
+    texts = [f"t{i}" for i in range(64)]
+    with StubOllama(dims=4) as stub:
+        client = make_client(stub, batch_size=2, max_batch_size=32, target_latency_s=10)
+        client.embed(texts)
+    assert client.batch_size > 2
+
+    with StubOllama(dims=4, delay_s=0.2) as stub:
+        client = make_client(stub, batch_size=16, target_latency_s=0.05)
+        client.embed(texts[:16])
+    assert client.batch_size < 16
+
+
+def test_on_request_and_metrics():
+    calls = []
+    with StubOllama(dims=4) as stub:
+        client = make_client(stub, batch_size=2)
+        client.embed(["a", "bb", "ccc"], on_request=lambda: calls.append(1))
+        metrics = client.metrics()
+
+    assert len(calls) == stub.requests
+    assert metrics["texts"] == 3
+    assert metrics["tokens"] == 6
+    assert metrics["texts_per_s"] > 0 and metrics["tokens_per_s"] > 0
+
+
+def test_unreachable_endpoint_raises_instead_of_failing_texts():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    client = EmbeddingClient(f"http://127.0.0.1:{port}", "stub", batch_size=16, backoff_s=0.001)
+    with pytest.raises(requests.ConnectionError):
+        client.embed([f"t{i}" for i in range(16)])
+    assert client.retries == client.max_retries
+    assert client.splits == 0
+    assert client.failed == 0
+
+
+def test_persistent_503_raises_after_retries():
+    with StubOllama(dims=4, unavailable_every=1) as stub:
+        client = make_client(stub, batch_size=16, backoff_s=0.001)
+        with pytest.raises(requests.HTTPError):
+            client.embed([f"t{i}" for i in range(16)])
+
+    assert stub.requests == client.max_retries + 1
+    assert client.splits == 0
+    assert client.failed == 0
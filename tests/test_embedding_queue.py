@@ -0,0 +1,205 @@
+import collections
+import os
+import subprocess
+import sys
+
+import pytest
+
+from stub_ollama import StubOllama
+
+psycopg = pytest.importorskip("psycopg")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DSN = os.environ.get("TEST_DATABASE_URL")
+MODEL = "stub-embed:test"
+
+pytestmark = pytest.mark.skipif(not DSN, reason="TEST_DATABASE_URL is not set (run `make up` and point it at the db)")
+
+
+@pytest.fixture
+def conn():
+    with psycopg.connect(DSN) as c:
+        cleanup(c)
+        yield c
+        cleanup(c)
+
+
+@pytest.fixture
+def embedding_config(tmp_path):
+    path = tmp_path / "embedding.yml"
+    path.write_text(f"model: {MODEL}\ndims: 1024\n", encoding="utf-8")
+    return str(path)
+
+
+def cleanup(c) -> None:
+    with c.cursor() as cur:
+        cur.execute("DELETE FROM search.embedding_queue WHERE model = %s", (MODEL,))
+        cur.execute("DELETE FROM search.place_embeddings WHERE model = %s", (MODEL,))
+        cur.execute("DELETE FROM search.places WHERE osm_type = 'test'")
+    c.commit()
+
+
+def insert_places(c, n: int) -> list:
+    with c.cursor() as cur:
+        place_ids = []
+        for i in range(n):
+            cur.execute(
+                """
+                INSERT INTO search.places (osm_type, osm_id, name, text_for_search)
+                VALUES ('test', %s, %s, %s)
+                RETURNING place_id
+                """,
+                (i, f"test {i}", f"test place {i} " + "x" * (i % 7)),
+            )
+            place_ids.append(cur.fetchone()[0])
+    c.commit()
+    return place_ids
+
+
+def run_workers(stub_url: str, config: str, worker_ids: list, *extra: str, returncode: int = 0) -> None:
+    procs = [
+        subprocess.Popen(
+            [
+                sys.executable, os.path.join(ROOT, "scripts", "embed_places.py"),
+                "--worker", "--dsn", DSN, "--ollama-url", stub_url, "--config", config,
+                "--worker-id", worker_id, "--fetch-size", "5", "--batch-size", "4", *extra,
+            ],
+            cwd=ROOT,
+        )
+        for worker_id in worker_ids
+    ]
+    for p in procs:
+        assert p.wait(timeout=120) == returncode
+
+
+def test_workers_never_claim_the_same_place_twice(conn, embedding_config):
+    place_ids = insert_places(conn, 60)
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO search.embedding_queue (place_id, model) SELECT unnest(%s::bigint[]), %s",
+            (place_ids, MODEL),
+        )
+    conn.commit()
+
+    with StubOllama(delay_s=0.02) as stub:
+        run_workers(stub.url, embedding_config, [f"w{i}" for i in range(4)])
+
+    counts = collections.Counter(stub.received)
+    assert len(counts) == 60
+    assert max(counts.values()) == 1
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT status, attempts, count(*) FROM search.embedding_queue WHERE model = %s GROUP BY 1, 2",
+            (MODEL,),
+        )
+        assert cur.fetchall() == [("done", 1, 60)]
+        cur.execute("SELECT count(*) FROM search.place_embeddings WHERE model = %s", (MODEL,))
+        assert cur.fetchone()[0] == 60
+
+
+def test_expired_lease_is_reclaimed(conn, embedding_config):
+    expired, live, exhausted = insert_places(conn, 3)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO search.embedding_queue (place_id, model, status, worker_id, attempts, claimed_at, lease_until)
+            VALUES
+              (%s, %s, 'claimed', 'dead', 1, now() - interval '10 minutes', now() - interval '5 minutes'),
+              (%s, %s, 'claimed', 'busy', 1, now(), now() + interval '10 minutes'),
+              (%s, %s, 'claimed', 'dead', 3, now() - interval '10 minutes', now() - interval '5 minutes')
+            """,
+            (expired, MODEL, live, MODEL, exhausted, MODEL),
+        )
+    conn.commit()
+
+    with StubOllama() as stub:
+        run_workers(stub.url, embedding_config, ["rescuer"], "--max-attempts", "3")
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT place_id, status, worker_id, attempts FROM search.embedding_queue WHERE model = %s",
+            (MODEL,),
+        )
+        rows = {r[0]: r[1:] for r in cur.fetchall()}
+    assert rows[expired] == ("done", "rescuer", 2)
+    assert rows[live] == ("claimed", "busy", 1)
+    assert rows[exhausted][0] == "failed"
+    assert len(stub.received) == 1
+
+
+def test_worker_marks_unembeddable_place_failed(conn, embedding_config):
+    place_ids = insert_places(conn, 6)
+    with conn.cursor() as cur:
+        cur.execute("UPDATE search.places SET text_for_search = 'BAD' WHERE place_id = %s", (place_ids[2],))
+        cur.execute(
+            "INSERT INTO search.embedding_queue (place_id, model) SELECT unnest(%s::bigint[]), %s",
+            (place_ids, MODEL),
+        )
+    conn.commit()
+
+    with StubOllama(fail_inputs={"BAD"}) as stub:
+        run_workers(stub.url, embedding_config, ["w0"])
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT place_id, status, last_error FROM search.embedding_queue WHERE model = %s",
+            (MODEL,),
+        )
+        rows = {r[0]: r[1:] for r in cur.fetchall()}
+    assert rows[place_ids[2]][0] == "failed"
+    assert "400" in rows[place_ids[2]][1]
+    assert all(rows[pid][0] == "done" for pid in place_ids if pid != place_ids[2])
+
+
+def test_outage_releases_claims_without_failing_rows(conn, embedding_config):
+    place_ids = insert_places(conn, 6)
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO search.embedding_queue (place_id, model) SELECT unnest(%s::bigint[]), %s",
+            (place_ids, MODEL),
+        )
+    conn.commit()
+
+    with StubOllama(unavailable_every=1) as stub:
+        run_workers(stub.url, embedding_config, ["w0"], "--max-retries", "1", returncode=1)
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT status, worker_id, attempts, count(*) FROM search.embedding_queue WHERE model = %s GROUP BY 1, 2, 3",
+            (MODEL,),
+        )
+        assert cur.fetchall() == [("pending", None, 0, 6)]
+
+
+def test_enqueue_resets_failed_rows(conn, embedding_config):
+    failed, done = insert_places(conn, 2)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO search.embedding_queue (place_id, model, status, attempts, last_error)
+            VALUES (%s, %s, 'failed', 3, 'boom'), (%s, %s, 'done', 1, NULL)
+            """,
+            (failed, MODEL, done, MODEL),
+        )
+        cur.execute(
+            f"INSERT INTO search.place_embeddings (place_id, model, embedding) VALUES (%s, %s, '[{','.join(['0'] * 1024)}]')",
+            (done, MODEL),
+        )
+    conn.commit()
+
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "scripts", "embed_places.py"), "--enqueue", "--dsn", DSN,
+         "--config", embedding_config],
+        cwd=ROOT,
+        check=True,
+    )
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT place_id, status, attempts, last_error FROM search.embedding_queue WHERE model = %s AND place_id = ANY(%s)",
+            (MODEL, [failed, done]),
+        )
+        rows = {r[0]: r[1:] for r in cur.fetchall()}
+    assert rows[failed] == ("pending", 0, None)
+    assert rows[done] == ("done", 1, None)
@@ -0,0 +1,192 @@
+import math
+import os
+
+import pytest
+
+import result_cache
+
+psycopg = pytest.importorskip("psycopg")
+
+DSN = os.environ.get("TEST_DATABASE_URL")
+SCENARIO = {"weights": {"text": 0.4, "vector": 0.4, "geo": 0.2}, "candidates": 200}
+
+needs_db = pytest.mark.skipif(not DSN, reason="TEST_DATABASE_URL is not set (run `make up` and point it at the db)")
+
+
+def key(**overrides) -> str:
+    args = {
+        "model": "m",
+        "ollama_url": "http://localhost:11434",
+        "scenario": "S3_geo_text_vector",
+        "scenario_cfg": SCENARIO,
+        "query_norm": "ramen",
+        "geo_key": "all",
+        "limit": 20,
+    }
+    args.update(overrides)
+    return result_cache.build_cache_key(**args)
+
+
+def test_normalize_query_folds_width_case_and_whitespace():
+    assert result_cache.normalize_query("  ＲＡＭＥＮ　 東京\t駅\n") == "ramen 東京 駅"
+    assert result_cache.normalize_query("ｶﾌｪ") == result_cache.normalize_query("カフェ")
+
+
+def test_snap_point_keeps_points_in_one_cell_together():
+    a = result_cache.snap_point(35.681236, 139.767125, 3000)
+    b = result_cache.snap_point(35.681300, 139.767200, 3000)
+    assert a == b
+
+
+def test_snap_point_cell_edges():
+    step = 300 / result_cache.METERS_PER_DEG_LAT
+    edge = 118 * step
+    below = result_cache.snap_point(edge - 1e-7, 0.0, 3000)
+    on = result_cache.snap_point(edge, 0.0, 3000)
+    assert below[0] == round(117.5 * step, 6)
+    assert on[0] == round(118.5 * step, 6)
+
+
+def test_snap_point_handles_negative_coordinates():
+    lat, lon = result_cache.snap_point(-33.8688, -70.6693, 1000)
+    step = 100 / result_cache.METERS_PER_DEG_LAT
+    assert lat < 0 and lon < 0
+    assert abs(lat - -33.8688) <= step / 2 + 1e-6
+    # Cells are half-open: [k, k+1) * step also below zero.
+    assert result_cache.snap_point(-1e-9, 0.0, 1000)[0] == round(-0.5 * step, 6)
+
+
+@pytest.mark.parametrize("radius_m", [50, 500, 3000, 20000])
+@pytest.mark.parametrize("lat, lon", [(35.6812, 139.7671), (-33.8688, 151.2093), (64.1466, -21.9426)])
+def test_snap_point_error_stays_a_small_share_of_the_radius(lat, lon, radius_m):
+    snapped_lat, snapped_lon = result_cache.snap_point(lat, lon, radius_m)
+    dy = (snapped_lat - lat) * result_cache.METERS_PER_DEG_LAT
+    dx = (snapped_lon - lon) * result_cache.METERS_PER_DEG_LAT * math.cos(math.radians(lat))
+    # Half the diagonal of a radius/10 cell, plus slack for the row-latitude step.
+    assert math.hypot(dx, dy) <= radius_m * 0.075
+
+
+def test_build_geo_key():
+    assert result_cache.build_geo_key("13", 35.0, 139.0, 3000) == "region:13"
+    assert result_cache.build_geo_key("", None, None, 3000) == "all"
+    assert result_cache.build_geo_key("", 35.0, 139.0, 3000) == "cell:35.000000,139.000000:r3000"
+    assert result_cache.build_geo_key("", 35.0, 139.0, 1500.5) == "cell:35.000000,139.000000:r1500.5"
+
+
+def test_cache_key_changes_with_every_input():
+    base = key()
+    assert key() == base
+    assert key(ollama_url="http://localhost:11434/") == base
+    for changed in (
+        key(model="other"),
+        key(ollama_url="http://gpu:11434"),
+        key(scenario="S2_geo_text"),
+        key(scenario_cfg={**SCENARIO, "candidates": 100}),
+        key(query_norm="udon"),
+        key(geo_key="region:13"),
+        key(limit=10),
+    ):
+        assert changed != base
+
+
+@pytest.fixture
+def conn():
+    with psycopg.connect(DSN) as c:
+        reset(c)
+        yield c
+        reset(c)
+
+
+def reset(c) -> None:
+    with c.cursor() as cur:
+        cur.execute("TRUNCATE search.result_cache")
+        cur.execute("UPDATE search.result_cache_stats SET hits = 0, misses = 0, saved_ms = 0, evictions = 0")
+    c.commit()
+
+
+def store(c, cache_key: str, data_version: int = 1, ttl_s: int = 3600, max_entries: int = 100) -> None:
+    result_cache.store(c, cache_key, data_version, "ramen", "S3", "all", [[1, "a", 0.5]], 40.0, ttl_s, max_entries)
+
+
+def stats(c) -> tuple:
+    with c.cursor() as cur:
+        cur.execute("SELECT hits, misses, saved_ms, evictions FROM search.result_cache_stats WHERE id = 1")
+        return cur.fetchone()
+
+
+def cached_keys(c) -> set:
+    with c.cursor() as cur:
+        cur.execute("SELECT cache_key FROM search.result_cache")
+        return {r[0] for r in cur.fetchall()}
+
+
+@needs_db
+def test_lookup_returns_stored_rows(conn):
+    store(conn, "k")
+    assert result_cache.lookup(conn, "k", 1, 3600) == ([[1, "a", 0.5]], 40.0)
+    assert result_cache.lookup(conn, "missing", 1, 3600) is None
+
+
+@needs_db
+def test_lookup_rejects_expired_entries(conn):
+    store(conn, "k")
+    with conn.cursor() as cur:
+        cur.execute("UPDATE search.result_cache SET created_at = now() - interval '2 hours'")
+    conn.commit()
+    assert result_cache.lookup(conn, "k", 1, 3600) is None
+    assert result_cache.lookup(conn, "k", 1, 3 * 3600) is not None
+
+
+@needs_db
+def test_lookup_rejects_other_data_versions(conn):
+    store(conn, "k", data_version=1)
+    assert result_cache.lookup(conn, "k", 2, 3600) is None
+
+
+@needs_db
+def test_store_evicts_older_versions_and_expired_entries(conn):
+    store(conn, "old", data_version=1)
+    store(conn, "stale", data_version=2)
+    with conn.cursor() as cur:
+        cur.execute("UPDATE search.result_cache SET created_at = now() - interval '2 hours' WHERE cache_key = 'stale'")
+    conn.commit()
+    store(conn, "new", data_version=2)
+    assert cached_keys(conn) == {"new"}
+    assert stats(conn)[3] == 2
+
+
+@needs_db
+def test_store_with_an_older_version_keeps_newer_entries(conn):
+    # A caller that read the version just before a bump stores under the old one.
+    store(conn, "newer", data_version=3)
+    store(conn, "late", data_version=2)
+    assert cached_keys(conn) == {"newer", "late"}
+    assert result_cache.lookup(conn, "newer", 3, 3600) is not None
+
+
+@needs_db
+def test_store_trims_least_recently_hit_entries(conn):
+    for k in ("a", "b", "c"):
+        store(conn, k)
+    with conn.cursor() as cur:
+        cur.execute("UPDATE search.result_cache SET last_hit_at = now() - interval '1 hour' WHERE cache_key = 'a'")
+        cur.execute("UPDATE search.result_cache SET last_hit_at = now() - interval '2 hours' WHERE cache_key = 'b'")
+    conn.commit()
+    store(conn, "d", max_entries=2)
+    assert cached_keys(conn) == {"c", "d"}
+    assert stats(conn)[3] == 2
+
+
+@needs_db
+def test_counters(conn):
+    store(conn, "k")
+    store(conn, "j")
+    cached = result_cache.lookup(conn, "k", 1, 3600)
+    result_cache.record_hit(conn, cached[1] - 5.0)
+    result_cache.record_hit(conn, -3.0)
+    hits, misses, saved_ms, evictions = stats(conn)
+    assert (hits, misses, evictions) == (2, 2, 0)
+    assert saved_ms == pytest.approx(35.0)
+    with conn.cursor() as cur:
+        cur.execute("SELECT hits FROM search.result_cache WHERE cache_key = 'k'")
+        assert cur.fetchone()[0] == 1
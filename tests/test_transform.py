@@ -0,0 +1,108 @@
+import gzip
+import os
+import shutil
+
+import pytest
+
+import transform
+
+psycopg = pytest.importorskip("psycopg")
+from psycopg.types.json import Jsonb  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE = os.path.join(ROOT, "tests", "fixtures", "daily.osc")
+DSN = os.environ.get("TEST_DATABASE_URL")
+MODEL = "stub-embed:test"
+
+EXPECTED_IDS = {
+    ("node", 9000000001),
+    ("node", 9000000002),
+    ("node", 9000000003),
+    ("node", 9000000004),
+    ("way", 9000000010),
+    ("relation", 9000000020),
+}
+
+
+def test_load_osc_ids_reads_create_modify_delete():
+    assert transform.load_osc_ids([FIXTURE]) == EXPECTED_IDS
+
+
+def test_load_osc_ids_reads_gzip_and_merges_files(tmp_path):
+    gz_path = str(tmp_path / "daily.osc.gz")
+    with open(FIXTURE, "rb") as src, gzip.open(gz_path, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    extra = tmp_path / "extra.osc"
+    extra.write_text('<osmChange version="0.6"><create><node id="7" lat="0" lon="0"/></create></osmChange>')
+
+    assert transform.load_osc_ids([gz_path, str(extra)]) == EXPECTED_IDS | {("node", 7)}
+
+
+def point_sql(lat: float, lon: float) -> str:
+    return f"ST_Transform(ST_SetSRID(ST_MakePoint({lon}, {lat}), 4326), 3857)"
+
+
+@pytest.mark.skipif(not DSN, reason="TEST_DATABASE_URL is not set (needs an imported raw schema)")
+def test_transform_changes_applies_fixture():
+    rules = transform.load_rules(os.path.join(ROOT, "config", "place_extract.yml"), "focused")
+
+    with psycopg.connect(DSN) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('raw.osm_points') IS NOT NULL")
+            if not cur.fetchone()[0]:
+                pytest.skip("raw.osm_points does not exist; run `make osm-import` first")
+
+            def put_node(osm_id: int, name: str, tags: dict, lat: float, lon: float) -> None:
+                tags = dict(tags, name=name)
+                cur.execute("DELETE FROM raw.osm_points WHERE osm_type = 'node' AND osm_id = %s", (osm_id,))
+                cur.execute(
+                    f"INSERT INTO raw.osm_points (osm_id, osm_type, tags, geom) VALUES (%s, 'node', %s, {point_sql(lat, lon)})",
+                    (osm_id, Jsonb(tags)),
+                )
+
+            # State before the diff: three places already transformed and embedded.
+            cafe = {"amenity": "cafe"}
+            put_node(9000000002, "古い名前のカフェ", cafe, 35.7110, 139.7970)
+            put_node(9000000003, "閉店したカフェ", cafe, 35.7120, 139.7980)
+            put_node(9000000004, "移転したコンビニ", {"shop": "convenience"}, 35.7120, 139.7980)
+            cur.execute("TRUNCATE raw.osm_changes")
+            transform.transform_changes(
+                cur, rules, {("node", 9000000002), ("node", 9000000003), ("node", 9000000004)}, MODEL
+            )
+            cur.execute(
+                "UPDATE search.embedding_queue SET status = 'done' WHERE model = %s", (MODEL,)
+            )
+
+            # What osm2pgsql --append would leave behind for tests/fixtures/daily.osc.
+            put_node(9000000001, "テスト喫茶", cafe, 35.7100, 139.7960)
+            put_node(9000000002, "新しい名前のカフェ", cafe, 35.7110, 139.7970)
+            put_node(9000000004, "移転したコンビニ", {"shop": "convenience"}, 35.7125, 139.7985)
+            cur.execute("DELETE FROM raw.osm_points WHERE osm_type = 'node' AND osm_id = 9000000003")
+            cur.execute("INSERT INTO raw.osm_changes VALUES ('node', 9000000001), ('node', 9000000002)")
+
+            stats = transform.transform_changes(cur, rules, transform.load_osc_ids([FIXTURE]), MODEL)
+
+            cur.execute(
+                """
+                SELECT p.osm_id, p.name, q.status
+                FROM search.places p
+                LEFT JOIN search.embedding_queue q ON q.place_id = p.place_id AND q.model = %s
+                WHERE p.osm_type = 'node' AND p.osm_id BETWEEN 9000000000 AND 9000000099
+                ORDER BY p.osm_id
+                """,
+                (MODEL,),
+            )
+            places = cur.fetchall()
+            cur.execute("SELECT count(*) FROM raw.osm_changes")
+            leftover_changes = cur.fetchone()[0]
+
+        conn.rollback()
+
+    assert stats == {"touched": 6, "upserted": 3, "deleted": 1, "queued": 2}
+    assert places == [
+        (9000000001, "テスト喫茶", "pending"),
+        (9000000002, "新しい名前のカフェ", "pending"),
+        # Only the geometry moved, so the existing embedding is kept.
+        (9000000004, "移転したコンビニ", "done"),
+    ]
+    assert leftover_changes == 0